@@ -1,12 +1,22 @@
-from flask import Flask, request, make_response, jsonify
+import json
+
+from flask import Flask, request, make_response, jsonify, Response
 from flask_restful import Resource, Api, reqparse, abort # to build RESTful API 
 import to_sql  # metaprogramming module 
+import explain  # cost estimates of the execution plan
+import relation  # relations to execute the queries on
+import rtypes
 
 import parser 
 
 app = Flask(__name__) # declaration this file (Inverted control )
 api = Api(app) #give the api
 
+# Source of the relation statistics used by explain, replace it to use real ones
+app.config.setdefault('RATST_STATISTICS', explain.Statistics())
+# Attributes of the known relations (name: [attributes]), used to generate the SQL
+app.config.setdefault('RATST_SCHEMA', {})
+
 
 class Index(Resource):
     """
@@ -22,19 +32,115 @@ class Index(Resource):
         """
         req_parser = reqparse.RequestParser() #get the request 
         req_parser.add_argument('query', type=str, help='The relational query is required', required=True)
+        req_parser.add_argument('explain', type=str, choices=('text', 'json'),
+                                help='The execution plan can be explained as text or json')
+        req_parser.add_argument('dialect', type=str, choices=tuple(to_sql.dialects),
+                                help='The SQL dialect of the result, MySQL compatible SQL if missing')
+        req_parser.add_argument('schema', type=_schema,
+                                help='The attributes of the relations, as a JSON object of name: [attributes]')
         args = req_parser.parse_args() # extract the query and convert the string to python dict marshling
         query = args.get('query') # get the query from the dictionary 
         try: # try catch errors both parse exeption and SQL
-            parsed_expression = parser.parse(query)
-            sql_expression = to_sql.to_mysql(parsed_expression)
+            if args.get('dialect'):
+                schema = dict(app.config['RATST_SCHEMA'], **(args.get('schema') or {}))
+                sql_expression = to_sql.generate(parser.tree(query), args.get('dialect'), schema)
+            else:
+                parsed_expression = parser.parse(query)
+                sql_expression = to_sql.to_mysql(parsed_expression)
+            if args.get('explain'):
+                plan = explain.explain(query, app.config['RATST_STATISTICS'], args.get('explain'))
+                return {'result': sql_expression, 'explain': plan}
             return {'result': sql_expression}
-        except (parser.ParserException, parser.TokenizerException) as e:
+        except (parser.ParserException, parser.TokenizerException, to_sql.SQLException) as e:
             return make_response((jsonify({'error': 'Sorry an error occurred, Try again.', 'error_message': str(e)})),
                                  400)
         
 
 
+class Execute(Resource):
+    """
+    Executes the relational query on the relations sent with it.
+    The result is streamed in chunks, one JSON object per line: first the header,
+    then the rows in lists of at most chunk_size rows
+    """
+
+    def post(self):
+        """
+        Get the result of the query
+        :return:
+        """
+        req_parser = reqparse.RequestParser()
+        req_parser.add_argument('query', type=str, location='json', help='The relational query is required', required=True)
+        req_parser.add_argument('relations', type=dict, location='json', help='The relations are required', required=True)
+        req_parser.add_argument('chunk_size', type=int, location='json', default=1000)
+        args = req_parser.parse_args()
+        try:
+            if args.get('chunk_size') is None or args.get('chunk_size') < 1:
+                raise relation.RelationException('chunk_size must be positive')
+            relations = _relations(args.get('relations'))
+            result = parser.plan(args.get('query'))(relations)
+        except (parser.ParserException, parser.TokenizerException, relation.RelationException, NameError) as e:
+            return make_response((jsonify({'error': 'Sorry an error occurred, Try again.', 'error_message': str(e)})),
+                                 400)
+
+        # The first chunk is computed before answering, so that the errors found
+        # setting up the pipeline can still be answered with a 400
+        chunks = result.chunks(args.get('chunk_size'))
+        try:
+            first = next(chunks, None)
+        except Exception as e:  # Errors evaluating the query on the rows, like a division by zero
+            return make_response((jsonify({'error': 'Sorry an error occurred, Try again.', 'error_message': str(e)})),
+                                 400)
+
+        def lines():
+            yield json.dumps({'header': result.header}) + '\n'
+            if first is None:
+                return
+            yield json.dumps({'rows': first}) + '\n'
+            try:
+                for chunk in chunks:
+                    yield json.dumps({'rows': chunk}) + '\n'
+            except Exception as e:  # The status has already been sent, the error ends the body
+                yield json.dumps({'error': 'Sorry an error occurred, Try again.', 'error_message': str(e)}) + '\n'
+
+        return Response(lines(), mimetype='application/x-ndjson')
+
+
+def _schema(value: str) -> dict:
+    """
+    Reads the name: [attributes] JSON object of the schema argument
+    :param value:
+    :return:
+    """
+    schema = json.loads(value)  # Raises a ValueError if it's not JSON
+    if not isinstance(schema, dict):
+        raise ValueError('The schema must be a JSON object')
+    for name, attributes in schema.items():
+        if not rtypes.is_valid_relation_name(name) or not isinstance(attributes, list) \
+                or not all(isinstance(a, str) and rtypes.is_valid_relation_name(a) for a in attributes):
+            raise ValueError("The attributes of '%s' must be a list of valid names" % name)
+    return schema
+
+
+def _relations(data: dict) -> dict:
+    """
+    Creates the relations from the name: {"header": [...], "rows": [[...], ...]} dictionary
+    :param data:
+    :return:
+    """
+    relations = {}
+    for name, content in data.items():
+        if not isinstance(content, dict) or not isinstance(content.get('header'), list):
+            raise relation.RelationException("'%s' must have a header list and a rows list" % name)
+        try:
+            relations[name] = relation.Relation(content.get('header'), content.get('rows', []))
+        except TypeError:
+            raise relation.RelationException("The rows of '%s' must be lists of values" % name)
+    return relations
+
+
 api.add_resource(Index, '/') # add url
+api.add_resource(Execute, '/execute')
 
 if __name__ == '__main__': # run 
     app.run(debug=True)
@@ -0,0 +1,54 @@
+# RATST Parser benchmark
+#
+# Measures the time and the peak memory needed to parse generated
+# relational expressions of increasing size.
+#
+# Usage: python benchmark.py [repetitions]
+#
+import sys
+import time
+import tracemalloc
+
+import parser
+
+
+def generate(operands: int) -> str:
+    """Generates an expression made of the given number of
+    selections and projections, joined by binary operators"""
+    operators = (parser.UNION, parser.DIFFERENCE, parser.JOIN, parser.INTERSECTION)
+    parts = []
+    for i in range(operands):
+        parts.append("π author, title (σ year > %d ∧ subject = 'db (%d)' (Books%d))" % (1900 + i, i, i))
+    expression = parts[0]
+    for i, part in enumerate(parts[1:]):
+        expression = '%s %s %s' % (expression, operators[i % len(operators)], part)
+    return expression
+
+
+def measure(expression: str, repetitions: int) -> tuple:
+    """Returns the average time in seconds and the peak memory
+    in bytes of parsing the expression"""
+    # parse caches its results, the uncached function is measured
+    parse = parser.parse.__wrapped__
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        parse(expression)
+    elapsed = (time.perf_counter() - start) / repetitions
+
+    tracemalloc.start()
+    parse(expression)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(repetitions: int = 5) -> None:
+    print('%10s %12s %14s' % ('chars', 'ms/parse', 'peak KiB'))
+    for operands in (1, 10, 50, 100, 200):
+        expression = generate(operands)
+        elapsed, peak = measure(expression, repetitions)
+        print('%10d %12.3f %14.1f' % (len(expression), elapsed * 1000, peak / 1024))
+
+
+if __name__ == '__main__':
+    main(*(int(i) for i in sys.argv[1:2]))
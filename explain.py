@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# RATST Parser
+#
+# This module estimates the cardinality and the cost of every operator
+# of a relational expression, and prints the resulting execution plan.
+#
+from typing import Dict, List, Optional
+
+import parser
+import rtypes
+
+# Selectivity of the conditions that can't be estimated otherwise
+EQUALITY_SELECTIVITY = 0.1
+RANGE_SELECTIVITY = 1 / 3
+
+
+class Statistics:
+    """
+    The source of the statistics used by the estimates.
+
+    This default implementation knows the cardinality of the relations
+    it is given, and assumes default_cardinality for all the others.
+    Subclass it to read the statistics from a database catalog.
+    """
+    default_cardinality = 1000
+
+    def __init__(self, cardinalities: Optional[Dict[str, int]] = None,
+                 default_cardinality: Optional[int] = None) -> None:
+        self.cardinalities = dict(cardinalities or {})
+        if default_cardinality is not None:
+            self.default_cardinality = default_cardinality
+
+    def cardinality(self, relation: str) -> int:
+        """Returns the number of rows of the relation"""
+        return self.cardinalities.get(relation, self.default_cardinality)
+
+    def selectivity(self, condition: str) -> float:
+        """
+        Returns the fraction of rows satisfying the condition.
+        Every comparison is assumed independent from the others.
+        """
+        # The string literals are emptied, their content is not an operator
+        condition = rtypes.CONDITION_TOKEN.sub(
+            lambda m: "''" if m.group(0)[0] in '\'"' else m.group(0), condition)
+        selectivity = 0.0
+        for disjunct in condition.split('∨'):
+            s = 1.0
+            for comparison in disjunct.split('∧'):
+                if any(op in comparison for op in ('<', '>', '≤', '≥', '≠', '!=')):
+                    s *= RANGE_SELECTIVITY
+                else:
+                    s *= EQUALITY_SELECTIVITY
+            selectivity = selectivity + s - selectivity * s
+        return selectivity
+
+
+class Estimate:
+    """
+    The estimate for a node of the tree.
+
+    input_rows is the number of rows read from the children,
+    rows is the number of rows produced and cost is the number
+    of rows processed by the node and by its whole subtree.
+    """
+
+    def __init__(self, input_rows: float, rows: float, cost: float) -> None:
+        self.input_rows = input_rows
+        self.rows = rows
+        self.cost = cost
+
+    def __str__(self):
+        return 'rows=%d input=%d cost=%d' % (round(self.rows), round(self.input_rows), round(self.cost))
+
+
+def _binary_estimate(operator: str, left: float, right: float) -> tuple:
+    """Returns the output rows and the cost of a binary operator,
+    excluding the cost of the operands"""
+    join = left * right / max(left, right, 1)
+    if operator == parser.PRODUCT:
+        return left * right, left * right
+    elif operator == parser.JOIN:
+        return join, left + right + join
+    elif operator == parser.JOIN_LEFT:
+        rows = max(join, left)
+    elif operator == parser.JOIN_RIGHT:
+        rows = max(join, right)
+    elif operator == parser.JOIN_FULL:
+        rows = max(join, left, right)
+    elif operator == parser.UNION:
+        rows = left + right
+    elif operator == parser.DIFFERENCE:
+        rows = left
+    elif operator == parser.INTERSECTION:
+        rows = min(left, right)
+    else:  # Division
+        rows = left / max(right, 1)
+    return rows, left + right + rows
+
+
+def annotate(tree: parser.Node, statistics: Optional[Statistics] = None) -> parser.Node:
+    """
+    Sets the estimate property on every node of the tree.
+    Returns the tree itself.
+    """
+    if statistics is None:
+        statistics = Statistics()
+
+    if tree.kind == parser.RELATION:
+        rows = statistics.cardinality(str(tree.name))
+        tree.estimate = Estimate(rows, rows, rows)
+    elif tree.kind == parser.UNARY:
+        child = annotate(tree.child, statistics).estimate
+        rows = child.rows
+        cost = child.rows
+        if tree.name == parser.SELECTION:
+            rows = child.rows * statistics.selectivity(str(tree.prop))
+        elif tree.name == parser.RENAME:
+            cost = 0
+        tree.estimate = Estimate(child.rows, rows, child.cost + cost)
+    elif tree.kind == parser.BINARY:
+        left = annotate(tree.left, statistics).estimate
+        right = annotate(tree.right, statistics).estimate
+        rows, cost = _binary_estimate(tree.name, left.rows, right.rows)
+        tree.estimate = Estimate(left.rows + right.rows, rows, left.cost + right.cost + cost)
+    else:
+        raise ValueError('What kind of alien object is this?')
+    return tree
+
+
+def to_text(tree: parser.Node, level: int = 0) -> str:
+    """Returns the annotated tree as indented text, one operator per line"""
+    r = '  ' * level + str(tree.name)
+    if tree.kind == parser.UNARY:
+        r += ' %s' % tree.prop
+    r += '  (%s)\n' % tree.estimate
+    if tree.kind == parser.BINARY:
+        r += to_text(tree.left, level + 1)
+        r += to_text(tree.right, level + 1)
+    elif tree.kind == parser.UNARY:
+        r += to_text(tree.child, level + 1)
+    return r
+
+
+def to_dict(tree: parser.Node) -> dict:
+    """Returns the annotated tree as a dictionary that can be serialized to JSON"""
+    r = {
+        'operator': str(tree.name),
+        'operation': 'relation' if tree.kind == parser.RELATION else parser.op_functions[tree.name],
+        'input_rows': round(tree.estimate.input_rows),
+        'rows': round(tree.estimate.rows),
+        'cost': round(tree.estimate.cost),
+    }  # type: Dict[str, object]
+    children = []  # type: List[dict]
+    if tree.kind == parser.UNARY:
+        r['prop'] = str(tree.prop)
+        children.append(to_dict(tree.child))
+    elif tree.kind == parser.BINARY:
+        children.append(to_dict(tree.left))
+        children.append(to_dict(tree.right))
+    r['children'] = children
+    return r
+
+
+def explain(expression: str, statistics: Optional[Statistics] = None, output: str = 'text'):
+    """
+    Returns the execution plan of the relational expression,
+    as text or as a dictionary if output is 'json'
+    """
+    tree = annotate(parser.tree(expression), statistics)
+    if output == 'json':
+        return to_dict(tree)
+    return to_text(tree)
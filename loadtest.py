@@ -0,0 +1,232 @@
+# RATST Parser load test
+#
+# Drives the API with the requests of a corpus file and reports the
+# latency percentiles, the requests per second and the CPU time per
+# request, for every combination of uWSGI processes and threads.
+#
+# The server is started like in ratst.ini (wsgi:app, master process),
+# but listening on a local HTTP socket instead of the unix socket used
+# by nginx.
+#
+# Usage:
+#   python loadtest.py --processes 1,2,4 --threads 1,4
+#   python loadtest.py --url http://127.0.0.1:8000/ --pid 1234   (an already running server)
+#
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_corpus(path: str) -> List[Tuple[str, Optional[int]]]:
+    """Returns the URL query strings of the requests in the corpus,
+    with the expected status, or None if any 2xx status is expected"""
+    requests = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            query, _, rest = line.partition('\t')
+            params, _, status = rest.partition('\t')
+            request = urllib.parse.urlencode({'query': query})
+            if params.strip():
+                request += '&' + params.strip()
+            requests.append((request, int(status) if status.strip() else None))
+    if not requests:
+        raise ValueError('No requests in %s' % path)
+    return requests
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def process_cpu(pid: int) -> Optional[float]:
+    """
+    Returns the CPU seconds used by the process and its children
+    until now, reading /proc. Returns None if it's not available.
+    """
+    ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+    total = 0
+    found = False
+    try:
+        entries = os.listdir('/proc')
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name can contain spaces, the fields start after it
+        fields = stat[stat.rindex(')') + 2:].split()
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += int(fields[11]) + int(fields[12])  # utime + stime
+            found = True
+    return total / ticks if found else None
+
+
+def free_port() -> int:
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def start_uwsgi(processes: int, threads: int, port: int) -> subprocess.Popen:
+    """Starts uWSGI serving wsgi:app and waits until it accepts connections"""
+    uwsgi = shutil.which('uwsgi')
+    if uwsgi is None:
+        raise RuntimeError('uwsgi is not installed, use --url to test a running server')
+    command = [uwsgi, '--module', 'wsgi:app', '--master', '--die-on-term',
+               '--processes', str(processes), '--threads', str(threads),
+               '--http-socket', '127.0.0.1:%d' % port, '--disable-logging']
+    server = subprocess.Popen(command, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('uwsgi exited with status %d' % server.returncode)
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    stop(server)
+    raise RuntimeError('uwsgi did not start')
+
+
+def stop(server: subprocess.Popen) -> None:
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(10)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def request(url: str, expected: Optional[int] = None) -> Tuple[float, bool]:
+    """Returns the latency of the request in seconds, and if it succeeded:
+    the status is the expected one, or any 2xx status if none is expected."""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        status = e.code
+    except OSError:
+        return time.perf_counter() - start, False
+    ok = status == expected if expected is not None else 200 <= status < 300
+    return time.perf_counter() - start, ok
+
+
+def run(base_url: str, corpus: List[Tuple[str, Optional[int]]], requests: int, concurrency: int, seed: int) -> dict:
+    """Sends the requests and returns the measures"""
+    rng = random.Random(seed)
+    chosen = [rng.choice(corpus) for _ in range(requests)]
+    urls = [base_url + '?' + query for query, _ in chosen]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(request, urls, [status for _, status in chosen]))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(r[0] for r in results)
+    return {
+        'requests': requests,
+        'errors': sum(1 for r in results if not r[1]),
+        'rps': requests / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def measure(base_url: str, corpus: List[Tuple[str, Optional[int]]], args, pid: Optional[int] = None) -> dict:
+    """Warms up the server, then runs the load and measures the CPU of pid"""
+    run(base_url, corpus, args.warmup, args.concurrency, args.seed + 1)
+    cpu = process_cpu(pid) if pid is not None else None
+    result = run(base_url, corpus, args.requests, args.concurrency, args.seed)
+    if cpu is not None:
+        after = process_cpu(pid)
+        result['cpu_ms_per_request'] = (after - cpu) * 1000 / args.requests if after is not None else None
+    else:
+        result['cpu_ms_per_request'] = None
+    return result
+
+
+def report(results: List[dict]) -> str:
+    """Formats the results as a table"""
+    lines = ['%9s %7s %9s %7s %9s %9s %9s %12s' % (
+        'processes', 'threads', 'requests', 'errors', 'req/s', 'p50 ms', 'p99 ms', 'cpu ms/req')]
+    for r in results:
+        cpu = r['cpu_ms_per_request']
+        lines.append('%9s %7s %9d %7d %9.1f %9.2f %9.2f %12s' % (
+            r.get('processes', '-'), r.get('threads', '-'), r['requests'], r['errors'], r['rps'],
+            r['p50_ms'], r['p99_ms'], '%.2f' % cpu if cpu is not None else 'n/a'))
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    def counts(value):
+        return [int(i) for i in value.split(',')]
+
+    arguments = argparse.ArgumentParser(description='Load test of the RATST API')
+    arguments.add_argument('--corpus', default=os.path.join(HERE, 'loadtest_corpus.txt'))
+    arguments.add_argument('--processes', type=counts, default=[1, 2, 4], help='uWSGI processes to try, e.g. 1,2,4')
+    arguments.add_argument('--threads', type=counts, default=[1, 4], help='uWSGI threads to try, e.g. 1,4')
+    arguments.add_argument('--requests', type=int, default=2000, help='Requests measured for each configuration')
+    arguments.add_argument('--warmup', type=int, default=100, help='Requests sent before measuring')
+    arguments.add_argument('--concurrency', type=int, default=16, help='Concurrent clients')
+    arguments.add_argument('--seed', type=int, default=0)
+    arguments.add_argument('--url', help='Test an already running server instead of starting uWSGI')
+    arguments.add_argument('--pid', type=int, help='uWSGI master of the server given with --url, to measure its CPU')
+    arguments.add_argument('--json', help='Also write the results to this file')
+    args = arguments.parse_args(argv)
+
+    corpus = load_corpus(args.corpus)
+    results = []
+    if args.url:
+        results.append(measure(args.url, corpus, args, args.pid))
+    else:
+        for processes in args.processes:
+            for threads in args.threads:
+                port = free_port()
+                server = start_uwsgi(processes, threads, port)
+                try:
+                    result = measure('http://127.0.0.1:%d/' % port, corpus, args, server.pid)
+                finally:
+                    stop(server)
+                result.update(processes=processes, threads=threads)
+                results.append(result)
+
+    print(report(results))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 1 if any(r['errors'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,7 +5,9 @@
 # to convert expressions into python expressions and to get the parse-tree
 # of the expression.
 #
-from typing import Optional, Union, List, Any
+import functools
+import re
+from typing import Optional, Union, List, Any, Tuple, Dict, Callable
 
 import rtypes
 
@@ -38,6 +40,9 @@ op_functions = {
     JOIN_LEFT: 'outer_left', JOIN_RIGHT: 'outer_right', JOIN_FULL: 'outer', PROJECTION: 'projection',
     SELECTION: 'selection', RENAME: 'rename'}
 
+# Operators are stored in the tokens as these shared strings
+_operator_tokens = {op: op for op in b_operators + u_operators}
+
 
 class TokenizerException(Exception):
     pass
@@ -57,14 +62,75 @@ class CallableString(str):
 
     It is used to contain Python expressions and print
     or execute them.
+
+    The expression is compiled the first time it is called, and the
+    code is reused by the following calls.
     """
 
+    def code(self):
+        """Returns the compiled expression"""
+        try:
+            return self._code
+        except AttributeError:
+            pass
+
+        self._code = compile(self, '<relational expression>', 'eval')
+        return self._code
+
     def __call__(self, context=None):
         """
         context is a dictionary where to
         each name is associated the relative relation
+
+        The expression only sees the names it uses from the
+        context, and no builtins. This is not a sandbox: only call
+        it on expressions generated by the parser, and use plan to
+        execute the expressions of the users.
         """
-        return eval(self, context)
+        code = self.code()
+        namespace = {'__builtins__': {}}  # type: Dict[str, Any]
+        if context:
+            namespace.update((name, context[name]) for name in code.co_names if name in context)
+        return eval(code, namespace)
+
+
+class Span:
+    """A token of a relational expression.
+
+    It does not contain a copy of the text, only a reference to the
+    original expression and the bounds of the token within it.
+    The text is created by str() when it is really needed, for example
+    when the python code is generated.
+
+    Spans compare equal to strings with the same content."""
+
+    __slots__ = ('source', 'start', 'end')
+
+    def __init__(self, source: str, start: int, end: int) -> None:
+        self.source = source
+        self.start = start
+        self.end = end
+
+    def __str__(self):
+        return self.source[self.start:self.end]
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __eq__(self, other):
+        if isinstance(other, Span):
+            other = str(other)
+        elif not isinstance(other, str):
+            return NotImplemented
+        return len(other) == len(self) and self.source.startswith(other, self.start)
+
+    __hash__ = None  # type: None
+
+
+Token = Union[str, Span, list]
 
 
 class Node:
@@ -82,6 +148,9 @@ class Node:
     child node and a property containing the string with the props of the
     operation.
 
+    The names of relations and the props are Span objects when the
+    tree is built from tokenize, so they refer to the original expression.
+
     This class is used to convert an expression into python code."""
     kind = None  # type: Optional[int]
     __hash__ = None  # type: None
@@ -89,20 +158,31 @@ class Node:
     def __init__(self, expression: Optional[list] = None) -> None:
         """Generates the tree from the tokenized expression
         If no expression is specified then it will create an empty node"""
-        print("inside init of node this is the express:", expression)
         if expression is None or len(expression) == 0:
             return
-
+        self._parse(expression, 0, len(expression))
+
+    @staticmethod
+    def _subtree(expression: list, start: int, end: int) -> 'Node':
+        """Returns the node for expression[start:end], without
+        copying the list"""
+        n = Node()
+        n._parse(expression, start, end)
+        return n
+
+    def _parse(self, expression: list, start: int, end: int) -> None:
+        """Builds the node from the tokens in expression[start:end]"""
         # If the list contains only a list, it will consider the lower level list.
         # This will allow things like ((((((a))))) to work
-        while len(expression) == 1 and isinstance(expression[0], list):
-            expression = expression[0]
+        while end - start == 1 and isinstance(expression[start], list):
+            expression = expression[start]
+            start, end = 0, len(expression)
 
         # The list contains only 1 string. Means it is the name of a relation
-        if len(expression) == 1:
+        if end - start == 1:
             self.kind = RELATION
-            self.name = expression[0]
-            if not rtypes.is_valid_relation_name(self.name):
+            self.name = expression[start]
+            if not rtypes.is_valid_relation_name(str(self.name)):
                 raise ParserException(
                     u"'%s' is not a valid relation name" % self.name)
             return
@@ -117,39 +197,40 @@ class Node:
         # Since it searches for strings, and expressions into parenthesis are
         # within sub-lists, they won't be found here, ensuring that they will
         # have highest priority.
-        for i in range(len(expression) - 1, -1, -1):
-            if expression[i] in b_operators:  # Binary operator
+        for i in range(end - 1, start - 1, -1):
+            if _is_operator(expression[i], b_operators):  # Binary operator
                 self.kind = BINARY
                 self.name = expression[i]
 
-                if len(expression[:i]) == 0:
+                if i == start:
                     raise ParserException(
                         u"Expected left operand for '%s'" % self.name)
 
-                if len(expression[i + 1:]) == 0:
+                if i + 1 == end:
                     raise ParserException(
                         u"Expected right operand for '%s'" % self.name)
 
-                self.left = node(expression[:i])
-                self.right = node(expression[i + 1:])
+                self.left = Node._subtree(expression, start, i)
+                self.right = Node._subtree(expression, i + 1, end)
                 return
         '''Searches for unary operators, parsing from right to left'''
-        for i in range(len(expression) - 1, -1, -1):
-            if expression[i] in u_operators:  # Unary operator
+        for i in range(end - 1, start - 1, -1):
+            if _is_operator(expression[i], u_operators):  # Unary operator
                 self.kind = UNARY
                 self.name = expression[i]
 
-                if len(expression) <= i + 2:
+                if end <= i + 2:
                     raise ParserException(
                         u"Expected more tokens in '%s'" % self.name)
 
-                self.prop = expression[1 + i].strip()
-                self.child = node(expression[2 + i])
+                self.prop = expression[1 + i]
+                if isinstance(self.prop, str):
+                    self.prop = self.prop.strip()
+                self.child = Node._subtree(expression, 2 + i, 3 + i)
 
                 return
-        raise ParserException("Expected operator in '%s'" % expression)
+        raise ParserException("Expected operator in '%s'" % expression[start:end])
 
-    
     def toPython(self) -> CallableString:
         """This method converts the AST into a python code string, which
         will require the relation module to be executed.
@@ -162,31 +243,80 @@ class Node:
         """
         Same as toPython but returns a regular string
         """
-        if self.name in b_operators:
-            print('the left side of binary  operators:', self.left.toPython())
-            return '%s.%s(%s)' % (self.left.toPython(), op_functions[self.name], self.right.toPython())
-        elif self.name in u_operators:
-            print('props:', self.prop)
-            prop = self.prop
+        code = []  # type: List[str]
+        self._emit(code)
+        return ''.join(code)
+
+    def _arguments(self) -> tuple:
+        """Returns the arguments of the method of a unary operator.
+        The names of projections and renames are validated here."""
+        if self.name == PROJECTION:
+            return tuple(_attribute_names(str(self.prop)))
+        elif self.name == RENAME:
+            return (_renames(str(self.prop)),)
+        return (str(self.prop),)
+
+    def toPlan(self) -> Callable[[Dict[str, Any]], Any]:
+        """Returns a function that executes the expression on a context,
+        the dictionary where to each name is associated the relative
+        relation.
+
+        No python code is generated: the function calls the methods
+        of the relations directly, with the arguments found here."""
+        if self.kind == BINARY:
+            left = self.left.toPlan()
+            right = self.right.toPlan()
+            method = op_functions[self.name]
+            return lambda context: getattr(left(context), method)(right(context))
+        elif self.kind == UNARY:
+            child = self.child.toPlan()
+            method = op_functions[self.name]
+            arguments = self._arguments()
+            return lambda context: getattr(child(context), method)(*arguments)
 
-            # Converting parameters
-            if self.name == PROJECTION:
-                prop = '\"%s\"' % prop.replace(' ', '').replace(',', '\",\"')
-            elif self.name == RENAME:
-                prop = '{\"%s\"}' % prop.replace(
-                    ',', '\",\"').replace(ARROW, '\":\"').replace(' ', '')
-            else:  # Selection
-                prop = repr(prop)
+        name = str(self.name)
 
-            return '%s.%s(%s)' % (self.child.toPython(), op_functions[self.name], prop)
-        return self.name
+        def relation(context: Dict[str, Any]) -> Any:
+            try:
+                return context[name]
+            except KeyError:
+                raise NameError("name '%s' is not defined" % name)
+        return relation
+
+    def _emit(self, code: List[str]) -> None:
+        """
+        Appends the fragments of the python code to the code list.
+        The text of the relations and props is only created here.
+        """
+        if self.kind == BINARY:
+            self.left._emit(code)
+            code.append('.%s(' % op_functions[self.name])
+            self.right._emit(code)
+            code.append(')')
+        elif self.kind == UNARY:
+            # Converting parameters, every string is written with repr,
+            # so the props can't inject code
+            props = []
+            for argument in self._arguments():
+                if isinstance(argument, dict):
+                    props.append('{%s}' % ','.join('%r:%r' % item for item in argument.items()))
+                elif isinstance(argument, set):
+                    props.append('{%s}' % ','.join(repr(a) for a in argument))
+                else:
+                    props.append(repr(argument))
+            prop = ','.join(props)
+
+            self.child._emit(code)
+            code.append('.%s(%s)' % (op_functions[self.name], prop))
+        else:
+            code.append(str(self.name))
 
     def printtree(self, level: int = 0) -> str:
         """returns a representation of the tree using indentation"""
         r = ''
         for i in range(level):
             r += '  '
-        r += self.name
+        r += str(self.name)
         if self.name in b_operators:
             r += self.left.printtree(level + 1)
             r += self.right.printtree(level + 1)
@@ -220,9 +350,9 @@ class Node:
 
     def __str__(self):
         if self.kind == RELATION:
-            return self.name
+            return str(self.name)
         elif self.kind == UNARY:
-            return self.name + " " + self.prop + " (" + self.child.__str__() + ")"
+            return self.name + " " + str(self.prop) + " (" + self.child.__str__() + ")"
         elif self.kind == BINARY:
             le = self.left.__str__()
             if self.right.kind != BINARY:
@@ -233,138 +363,225 @@ class Node:
         raise ValueError('What kind of alien object is this?')
 
 
-def _find_matching_parenthesis(expression: str, start=0, openpar=u'(', closepar=u')') -> Optional[int]:
-    """This function returns the position of the matching
-    close parenthesis to the 1st open parenthesis found
-    starting from start (0 by default)"""
-    par_count = 0  # Count of parenthesis
-
-    string = False
-    escape = False
-
-    for i in range(start, len(expression)):
-        if expression[i] == '\'' and not escape:
-            string = not string
-        if expression[i] == '\\' and not escape:
-            escape = True
+def _attribute_names(prop: str) -> List[str]:
+    """Returns the attributes in the comma separated list,
+    raising ParserException if any of them is not a valid name"""
+    names = [name.strip() for name in prop.split(',')]
+    for name in names:
+        if not rtypes.is_valid_relation_name(name):
+            raise ParserException(u"'%s' is not a valid attribute name" % name)
+    return names
+
+
+def _renames(prop: str) -> Union[Dict[str, str], set]:
+    """Returns the old: new dictionary of the props of a rename,
+    or a set with the new name of the relation.
+    Attributes can be renamed as old➡new or as new/old."""
+    renames = {}  # type: Dict[str, str]
+    items = prop.split(',')
+    for item in items:
+        if ARROW in item:
+            old, new = item.split(ARROW, 1)
+        elif '/' in item:
+            new, old = item.split('/', 1)
+        elif len(items) == 1:
+            return set(_attribute_names(item))
         else:
-            escape = False
-        if string:
-            continue
+            raise ParserException(u"Expected old%snew in '%s'" % (ARROW, item.strip()))
+        renames[_attribute_names(old)[0]] = _attribute_names(new)[0]
+    return renames
+
+
+def _is_operator(token: Token, operators: tuple) -> bool:
+    """Checks if the token is one of the operators.
+    Operators are always plain strings, so spans are not compared."""
+    return isinstance(token, str) and token in operators
+
+
+class _Scan:
+    """Precomputed lexical information about an expression.
+
+    The expression is walked once by a two state automaton (inside or
+    outside a string literal, plus the escape flag) and the result is
+    stored in index arrays:
+
+    quoted[i] is true if the character at i belongs to a string literal.
+    match[i] is the position of the parenthesis closing the one at i, or -1.
+    next_open[i] is the position of the first unquoted open parenthesis
+    at or after i, or -1.
+
+    This way the tokenizer can locate tokens and parenthesis in constant
+    time, without copying the expression."""
+
+    def __init__(self, expression: str, openpar=u'(', closepar=u')') -> None:
+        length = len(expression)
+        self.quoted = bytearray(length)
+        self.match = [-1] * length
+        self.next_open = [-1] * (length + 1)
+
+        stack = []  # type: List[int]
+        string = False
+        escape = False
+
+        for i, c in enumerate(expression):
+            if c == '\'' and not escape:
+                string = not string
+            escape = c == '\\' and not escape
+            if string:
+                self.quoted[i] = 1
+                continue
+
+            if c == openpar:
+                stack.append(i)
+            elif c == closepar and stack:
+                self.match[stack.pop()] = i
+
+        nearest = -1
+        for i in range(length - 1, -1, -1):
+            if expression[i] == openpar and not self.quoted[i]:
+                nearest = i
+            self.next_open[i] = nearest
+
+    def matching_parenthesis(self, start: int = 0, end: Optional[int] = None) -> Optional[int]:
+        """Returns the position of the parenthesis closing the 1st
+        open parenthesis found starting from start, or None if it
+        is not closed before end."""
+        if start >= len(self.next_open):
+            return None
+        openpar = self.next_open[start]
+        if openpar == -1:
+            return None
+        closepar = self.match[openpar]
+        if closepar == -1 or (end is not None and closepar >= end):
+            return None
+        return closepar
+
+    def open_parenthesis(self, start: int = 0, end: Optional[int] = None) -> int:
+        """Returns the position of the 1st open parenthesis outside of
+        string literals, starting from start, or -1."""
+        if start >= len(self.next_open):
+            return -1
+        openpar = self.next_open[start]
+        if end is not None and openpar >= end:
+            return -1
+        return openpar
+
+
+# Matches the longest relation name starting at a given position
+_RELATION_TOKEN = re.compile(rtypes.RELATION_NAME, rtypes.RELATION_NAME_REGEXP.flags)
+
+
+def _skip_spaces(expression: str, start: int, end: int) -> int:
+    """Returns the position of the first non blank character in
+    expression[start:end], or end."""
+    while start < end and expression[start].isspace():
+        start += 1
+    return start
+
+
+def _strip(expression: str, start: int, end: int) -> Tuple[int, int]:
+    """Like str.strip, but returns the bounds of the stripped
+    slice instead of copying it."""
+    start = _skip_spaces(expression, start, end)
+    while end > start and expression[end - 1].isspace():
+        end -= 1
+    return start, end
 
-        if expression[i] == openpar:
-            par_count += 1
-        elif expression[i] == closepar:
-            par_count -= 1
-            if par_count == 0:
-                return i  # Closing parenthesis of the parameter
-    return None
 
+def tokenize(expression: str) -> list:
+    """This function converts a relational expression into a list where
+    every token of the expression is an item of a list. Expressions into
+    parenthesis will be converted into sub lists.
 
-def _find_token(haystack: str, needle: str) -> int:
-    """
-    Like the string function find, but
-    ignores tokens that are within a string
-    literal.
-    """
-    r = -1
-    string = False
-    escape = False
-
-    for i in range(len(haystack)):
-        if haystack[i] == '\'' and not escape:
-            string = not string
-        if haystack[i] == '\\' and not escape:
-            escape = True
-        else:
-            escape = False
-        if string:
-            continue
+    Operators are returned as strings, all the other tokens are Span
+    objects referring to the expression."""
+    return _tokenize(expression, _Scan(expression), 0, len(expression))
 
-        if haystack[i:].startswith(needle):
-            return i
-    return r
 
+def _tokenize(expression: str, scan: _Scan, start: int, end: int) -> list:
+    """Tokenizes expression[start:end].
 
-def tokenize(expression: str) -> list:
-    """This function converts a relational expression into a list where
-    every token of the expression is an item of a list. Expressions into
-    parenthesis will be converted into sub lists."""
+    The expression is never sliced, parenthesis and string literals
+    are located using the scan of the whole expression."""
 
     # List for the tokens
-    print('inside the tokenize expression', expression)
-    items = []  # type: List[Union[str,list]]
+    items = []  # type: List[Token]
 
-    expression = expression.strip()  # Removes initial and ending spaces
+    start, end = _strip(expression, start, end)  # Removes initial and ending spaces
 
-    while len(expression) > 0:
-        if expression.startswith('('):  # Parenthesis state
-            print('inside tokenize function and it starts with (')
-            end = _find_matching_parenthesis(expression)
-            print('then the ending bracket:', end)
-            if end is None:
+    while start < end:
+        if expression[start] == '(':  # Parenthesis state
+            close = scan.matching_parenthesis(start, end)
+            if close is None:
                 raise TokenizerException(
-                    "Missing matching ')' in '%s'" % expression)
+                    "Missing matching ')' in '%s'" % expression[start:end])
             # Appends the tokenization of the content of the parenthesis
-            print('content of parenthesis to be  tokenized:', expression[1:end])
-            items.append(tokenize(expression[1:end]))
-            print('then the items are:', items)
-            # Removes the entire parenthesis and content from the expression
-            expression = expression[end + 1:].strip()
-            print('so the final expression is:', expression)
-
-        elif expression.startswith((SELECTION, RENAME, PROJECTION)):  # Unary operators
-            print('else the expression starts with either selection, rename or projection')
-            print('append the unary operator to the array:', expression[0:1])
-            items.append(expression[0:1])
-            # Adding operator in the top of the list
-            expression = expression[1:].strip()  # Removing operator from the expression
-            print('remove the operator from the new parenthesis:', expression)
+            items.append(_tokenize(expression, scan, start + 1, close))
+            # Skips the entire parenthesis and content
+            start = _skip_spaces(expression, close + 1, end)
 
-            if expression.startswith('('):  # Expression with parenthesis, so adding what's between open and close without tokenization
-                par = expression.find( '(', _find_matching_parenthesis(expression))
-                print('So the remaining expression check if it starts with a paranthesis:', par)
+        elif expression[start] in (SELECTION, RENAME, PROJECTION):  # Unary operators
+            # Adding operator in the top of the list
+            items.append(_operator_tokens[expression[start]])
+            start = _skip_spaces(expression, start + 1, end)  # Skipping the operator
+
+            if start < end and expression[start] == '(':  # Expression with parenthesis, so adding what's between open and close without tokenization
+                close = scan.matching_parenthesis(start, end)
+                if close is None:
+                    raise TokenizerException(
+                        "Missing matching ')' in '%s'" % expression[start:end])
+                par = scan.open_parenthesis(close, end)
             else:  # Expression without parenthesis, so adding what's between start and parenthesis as whole
-                par = _find_token(expression, '(')
-                print('It does not start with a parenthesis so pick everything:', par)
+                par = scan.open_parenthesis(start, end)
+            if par == -1:
+                par = max(end - 1, start)
 
-            print('so pick everything from that index:', expression[:par].strip())
-            items.append(expression[:par].strip())
-            print('append everything found to the items array:', items)
             # Inserting parameter of the operator
-            expression = expression[par:].strip()  # Removing parameter from the expression
-            print('the remove what we found from the original expression given')
+            prop_start, prop_end = _strip(expression, start, par)
+            items.append(Span(expression, prop_start, prop_end))
+            start = _skip_spaces(expression, par, end)  # Skipping the parameter
         else:  # Relation (hopefully)
-            expression += ' '  # To avoid the special case of the ending
-
             # Initial part is a relation, stop when the name of the relation is
             # over
-            for r in range(1, len(expression)):
-                if rtypes.RELATION_NAME_REGEXP.match(expression[:r + 1]) is None:
-                    break
-            print('all other statements were false so:', expression[:r])
-            items.append(expression[:r])
-            expression = expression[r:].strip()
+            name = _RELATION_TOKEN.match(expression, start, end)
+            r = name.end() if name is not None else start + 1
+            if name is None and expression[start] in _operator_tokens:
+                items.append(_operator_tokens[expression[start]])
+            else:
+                items.append(Span(expression, start, r))
+            start = _skip_spaces(expression, r, end)
     return items
 
 
 def tree(expression: str) -> Node:
     """This function parses a relational algebra expression into a AST and returns
     the root node using the Node class."""
-    print('inside the tree function:', expression)
     return Node(tokenize(expression))
 
 
+@functools.lru_cache(maxsize=256)
 def parse(expr: str) -> CallableString:
     """This function parses a relational algebra expression, and returns a
     CallableString (a string that can be called) with the corresponding
     Python expression.
+
+    The results are cached, so parsing an expression again returns the
+    same, already compiled, CallableString.
     """
-    print('inside parse function:', expr)
-    print('the tree:\n', tree(expr).printtree(level=5))
     return tree(expr).toPython()
 
 
+@functools.lru_cache(maxsize=256)
+def plan(expr: str) -> Callable[[Dict[str, Any]], Any]:
+    """This function parses a relational algebra expression, and returns
+    a function that executes it on a context of name: relation, as
+    Node.toPlan does.
+
+    The results are cached like the ones of parse.
+    """
+    return tree(expr).toPlan()
+
+
 # Backwards compatibility
 node = Node
 
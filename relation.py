@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+# RATST Parser
+#
+# This module implements the relations on which the python expressions
+# generated by the parser can be executed, for example
+# Books.selection("year > 2000").projection("author")
+#
+# Operators don't compute their result when they are called: every
+# relation only knows how to produce its rows, and the rows are pulled
+# one at a time through the whole chain of operators when the result
+# is iterated. Only the operators that need to remember rows (joins,
+# set operations, duplicate removal) keep them, in hash tables.
+#
+import ast
+import itertools
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import rtypes
+
+Row = Tuple[Any, ...]
+
+
+class RelationException(Exception):
+    pass
+
+
+_CONDITION_OPERATORS = {'=': '==', '≠': '!=', '≤': '<=', '≥': '>=',
+                        '∧': ' and ', '∨': ' or ', '¬': ' not '}
+
+
+# The only python syntax allowed in a condition: comparisons, logical and
+# arithmetic operators, attributes and literals. Anything else (calls,
+# attributes of objects, subscripts, lambdas, comprehensions...) could
+# reach objects outside of the row, so it is rejected.
+# Powers and shifts are excluded because they can create huge numbers.
+_CONDITION_NODES = (ast.Expression, ast.Compare, ast.BoolOp, ast.UnaryOp, ast.BinOp, ast.Name, ast.Constant,
+                    ast.Load, ast.cmpop, ast.boolop, ast.unaryop,
+                    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod)
+
+_CONDITION_CONSTANTS = (str, int, float, bool, type(None))
+
+
+def _compile_condition(condition: str, header: Tuple[str, ...]):
+    """Compiles the condition of a selection into python code,
+    checking that it only uses attributes of the header and
+    the allowed syntax"""
+    python = rtypes.CONDITION_TOKEN.sub(lambda m: _CONDITION_OPERATORS.get(m.group(0), m.group(0)), condition)
+    try:
+        tree = ast.parse(python.strip(), '<condition>', 'eval')
+    except SyntaxError:
+        raise RelationException("'%s' is not a valid condition" % condition)
+    for node in ast.walk(tree):
+        if not isinstance(node, _CONDITION_NODES):
+            raise RelationException("'%s' is not allowed in the condition '%s'" % (type(node).__name__, condition))
+        if isinstance(node, ast.Name) and node.id not in header:
+            raise RelationException("Unknown attribute '%s' in '%s'" % (node.id, condition))
+        if isinstance(node, ast.Constant) and not isinstance(node.value, _CONDITION_CONSTANTS):
+            raise RelationException("%r is not allowed in the condition '%s'" % (node.value, condition))
+    return compile(tree, '<condition>', 'eval')
+
+
+def _autocast(value: Any) -> Any:
+    """Converts strings to the value they represent, for the conditions"""
+    if isinstance(value, str):
+        return rtypes.Rstring(value).autocast()
+    return value
+
+
+class Relation:
+    """
+    A relation: a header, which is the tuple of the names of the
+    attributes, and a set of rows.
+
+    rows can be any iterable, whose rows are copied into the relation,
+    or a function that returns a new iterator over the rows every time it
+    is called. In the second case the rows are not stored, and they are
+    computed again every time the relation is iterated. They must be
+    unique.
+
+    size is the number of rows, if it is known.
+    """
+
+    def __init__(self, header: Iterable[str], rows: Union[Iterable[Iterable], Callable[[], Iterator[Row]]] = (),
+                 size: Optional[int] = None) -> None:
+        self.header = tuple(header)
+        for attribute in self.header:
+            if not rtypes.is_valid_relation_name(attribute):
+                raise RelationException("'%s' is not a valid attribute name" % attribute)
+        if len(set(self.header)) != len(self.header):
+            raise RelationException('Repeated attribute names in %s' % (self.header,))
+
+        if callable(rows):
+            self._rows = rows
+            self.size = size
+        else:
+            stored = list(dict.fromkeys(tuple(row) for row in rows))
+            for row in stored:
+                if len(row) != len(self.header):
+                    raise RelationException('The row %s does not match the header %s' % (row, self.header))
+            self._rows = lambda: iter(stored)
+            self.size = len(stored)
+
+    def __iter__(self) -> Iterator[Row]:
+        return self._rows()
+
+    def chunks(self, size: int = 1000) -> Iterator[List[Row]]:
+        """Returns the rows in lists of at most size rows"""
+        rows = iter(self)
+        while True:
+            chunk = list(itertools.islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _indices(self, attributes: Iterable[str]) -> List[int]:
+        """Returns the positions of the attributes in the header"""
+        try:
+            return [self.header.index(a) for a in attributes]
+        except ValueError:
+            raise RelationException('Attributes %s not found in %s' % (tuple(attributes), self.header))
+
+    def _same_header(self, other: 'Relation') -> 'Relation':
+        """Returns other with the attributes in the same order of self"""
+        if set(self.header) != set(other.header) or len(self.header) != len(other.header):
+            raise RelationException('The headers %s and %s are not compatible' % (self.header, other.header))
+        if self.header == other.header:
+            return other
+        return other.projection(*self.header)
+
+    def _common(self, other: 'Relation') -> List[str]:
+        """Returns the attributes that are in both the headers"""
+        return [a for a in self.header if a in other.header]
+
+    # Unary operators
+
+    def selection(self, expr: str) -> 'Relation':
+        code = _compile_condition(expr, self.header)
+        header = self.header
+        namespace = {'__builtins__': {}}  # type: Dict[str, Any]
+
+        def rows():
+            for row in self:
+                if eval(code, namespace, dict(zip(header, map(_autocast, row)))):
+                    yield row
+        return Relation(self.header, rows)
+
+    def projection(self, *attributes: str) -> 'Relation':
+        indices = self._indices(attributes)
+        if indices == list(range(len(self.header))):
+            return self
+
+        def rows():
+            seen = set()
+            for row in self:
+                projected = tuple(row[i] for i in indices)
+                if projected not in seen:
+                    seen.add(projected)
+                    yield projected
+        return Relation(attributes, rows)
+
+    def rename(self, params: Union[Dict[str, str], set]) -> 'Relation':
+        """Renames the attributes as in the old:new dictionary.
+        A set is the new name of the relation, which does not change
+        the relation itself."""
+        if not isinstance(params, dict):
+            return self
+        self._indices(params)
+        return Relation([params.get(a, a) for a in self.header], self._rows, self.size)
+
+    # Binary operators
+
+    def product(self, other: 'Relation') -> 'Relation':
+        """The smaller relation (the right one if the sizes are not known)
+        is computed once and kept in a list, the other is streamed"""
+        if self._common(other):
+            raise RelationException('The headers %s and %s have common attributes' % (self.header, other.header))
+        keep_left = self.size is not None and other.size is not None and self.size < other.size
+
+        def rows():
+            if keep_left:
+                lefts = list(self)
+                for right in other:
+                    for left in lefts:
+                        yield left + right
+            else:
+                rights = list(other)
+                for left in self:
+                    for right in rights:
+                        yield left + right
+        return Relation(self.header + other.header, rows)
+
+    def _hash_join(self, other: 'Relation', outer_left: bool = False, outer_right: bool = False) -> 'Relation':
+        """
+        Natural join of self and other, optionally keeping the rows
+        without a match on the left and/or on the right.
+        Only one of the relations is kept in a hash table, the smaller
+        when both sizes are known, the right one otherwise.
+        """
+        common = self._common(other)
+        left_key = self._indices(common)
+        right_key = other._indices(common)
+        right_rest = [i for i, a in enumerate(other.header) if a not in common]
+        header = self.header + tuple(other.header[i] for i in right_rest)
+        right_padding = tuple(None for _ in right_rest)
+
+        def output(left: Row, right: Row) -> Row:
+            return left + tuple(right[i] for i in right_rest)
+
+        def pad_right(right: Row) -> Row:
+            """Returns the row of right without a match on the left"""
+            left = [None] * len(self.header)  # type: List[Any]
+            for i, j in zip(left_key, right_key):
+                left[i] = right[j]
+            return output(tuple(left), right)
+
+        build_left = self.size is not None and other.size is not None and self.size < other.size
+
+        def rows():
+            matched = set()
+            if build_left:
+                table = {}  # type: Dict[Row, List[Row]]
+                for left in self:
+                    table.setdefault(tuple(left[i] for i in left_key), []).append(left)
+                for right in other:
+                    key = tuple(right[i] for i in right_key)
+                    if key in table:
+                        matched.add(key)
+                        for left in table[key]:
+                            yield output(left, right)
+                    elif outer_right:
+                        yield pad_right(right)
+                if outer_left:
+                    for key, lefts in table.items():
+                        if key not in matched:
+                            for left in lefts:
+                                yield left + right_padding
+            else:
+                table = {}
+                for right in other:
+                    table.setdefault(tuple(right[i] for i in right_key), []).append(right)
+                for left in self:
+                    key = tuple(left[i] for i in left_key)
+                    if key in table:
+                        matched.add(key)
+                        for right in table[key]:
+                            yield output(left, right)
+                    elif outer_left:
+                        yield left + right_padding
+                if outer_right:
+                    for key, rights in table.items():
+                        if key not in matched:
+                            for right in rights:
+                                yield pad_right(right)
+        return Relation(header, rows)
+
+    def join(self, other: 'Relation') -> 'Relation':
+        return self._hash_join(other)
+
+    def outer_left(self, other: 'Relation') -> 'Relation':
+        return self._hash_join(other, outer_left=True)
+
+    def outer_right(self, other: 'Relation') -> 'Relation':
+        return self._hash_join(other, outer_right=True)
+
+    def outer(self, other: 'Relation') -> 'Relation':
+        return self._hash_join(other, outer_left=True, outer_right=True)
+
+    def union(self, other: 'Relation') -> 'Relation':
+        other = self._same_header(other)
+        small, large = (other, self) if self.size is not None and other.size is not None \
+            and other.size < self.size else (self, other)
+
+        def rows():
+            seen = set()
+            for row in small:
+                seen.add(row)
+                yield row
+            for row in large:
+                if row not in seen:
+                    yield row
+        return Relation(self.header, rows)
+
+    def difference(self, other: 'Relation') -> 'Relation':
+        other = self._same_header(other)
+
+        def rows():
+            exclude = set(other)
+            for row in self:
+                if row not in exclude:
+                    yield row
+        return Relation(self.header, rows)
+
+    def intersection(self, other: 'Relation') -> 'Relation':
+        other = self._same_header(other)
+
+        def rows():
+            keep = set(other)
+            for row in self:
+                if row in keep:
+                    yield row
+        return Relation(self.header, rows)
+
+    def division(self, other: 'Relation') -> 'Relation':
+        divisor = set(other.header)
+        if not divisor < set(self.header):
+            raise RelationException('The header %s is not contained in %s' % (other.header, self.header))
+        quotient = [a for a in self.header if a not in divisor]
+        quotient_indices = self._indices(quotient)
+        divisor_indices = self._indices(other.header)
+
+        def rows():
+            required = set(other)
+            if not required:
+                yield from self.projection(*quotient)
+                return
+            groups = {}  # type: Dict[Row, set]
+            for row in self:
+                value = tuple(row[i] for i in divisor_indices)
+                if value in required:
+                    groups.setdefault(tuple(row[i] for i in quotient_indices), set()).add(value)
+            for key, values in groups.items():
+                if len(values) == len(required):
+                    yield key
+        return Relation(quotient, rows)
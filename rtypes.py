@@ -7,7 +7,11 @@ import keyword
 import re
 from typing import Union
 
-RELATION_NAME_REGEXP = re.compile(r'^[_a-z][_a-z0-9]*$', re.IGNORECASE)
+RELATION_NAME = r'[_a-z][_a-z0-9]*'
+RELATION_NAME_REGEXP = re.compile(r'^%s$' % RELATION_NAME, re.IGNORECASE)
+
+# Matches the string literals and the operators of the condition of a selection
+CONDITION_TOKEN = re.compile(r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|==|!=|<=|>=|[=≠≤≥∧∨¬]""")
 
 
 class Rstring(str):
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+pytest.importorskip('flask_restful')
+
+import app  # noqa: E402
+
+
+@pytest.fixture
+def client():
+    app.app.config['TESTING'] = True
+    return app.app.test_client()
+
+
+def test_index_schema(client):
+    query = {'query': 'Books - Articles', 'dialect': 'mysql'}
+    assert client.get('/', query_string=query).status_code == 400
+
+    query['schema'] = json.dumps({'Books': ['author'], 'Articles': ['author']})
+    response = client.get('/', query_string=query)
+    assert response.status_code == 200
+    assert 'NOT EXISTS' in response.get_json()['result']
+
+
+@pytest.mark.parametrize('schema', ['[]', '{"Books": "author"}', '{"Books": ["a b"]}', '{"Books": ["a"', '{"1": []}'])
+def test_index_invalid_schema(client, schema):
+    response = client.get('/', query_string={'query': 'Books', 'dialect': 'mysql', 'schema': schema})
+    assert response.status_code == 400
+
+
+RELATIONS = {
+    'Books': {'header': ['author', 'year'], 'rows': [['ann', 1999], ['bob', 2005], ['cid', 2010]]},
+    'Articles': {'header': ['author'], 'rows': [['ann'], ['dan']]},
+}
+
+
+def lines(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_execute(client):
+    response = client.post('/execute', json={
+        'query': 'π author (σ year > 2000 (Books)) ∪ π author (Articles)',
+        'relations': RELATIONS,
+        'chunk_size': 2,
+    })
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    body = lines(response)
+    assert body[0] == {'header': ['author']}
+    assert [len(line['rows']) for line in body[1:]] == [2, 2]
+    assert sorted(row for line in body[1:] for row in line['rows']) == [['ann'], ['bob'], ['cid'], ['dan']]
+
+
+def test_execute_empty(client):
+    response = client.post('/execute', json={'query': 'σ year > 3000 (Books)', 'relations': RELATIONS})
+    assert response.status_code == 200
+    assert lines(response) == [{'header': ['author', 'year']}]
+
+
+@pytest.mark.parametrize('data', [
+    {'query': 'π author (Books', 'relations': RELATIONS},
+    {'query': 'π author (Missing)', 'relations': RELATIONS},
+    {'query': 'σ writer = 1 (Books)', 'relations': RELATIONS},
+    {'query': 'σ year / 0 = 1 (Books)', 'relations': RELATIONS},
+    {'query': 'Books ∪ Articles', 'relations': RELATIONS},
+    {'query': 'Books', 'relations': {'Books': {'header': ['a b'], 'rows': []}}},
+    {'query': 'Books', 'relations': {'Books': {'rows': []}}},
+    {'query': 'Books', 'relations': {'Books': {'header': ['a'], 'rows': [1]}}},
+    {'query': 'Books', 'relations': RELATIONS, 'chunk_size': 0},
+    {'query': 'Books', 'relations': RELATIONS, 'chunk_size': None},
+    {'query': 'Books', 'relations': RELATIONS, 'chunk_size': 'many'},
+    {'relations': RELATIONS},
+    {'query': 'Books'},
+    {'query': 'π a\'"if[c\tfor\tc\tin\t().__class__.__base__.__subclasses__()\tif\tc.__name__=="_wrap_close"][0]'
+              '.__init__.__globals__["system"]("echo\tPWNED")else"a\'(Books)', 'relations': RELATIONS},
+])
+def test_execute_errors(client, data):
+    response = client.post('/execute', json=data)
+    assert response.status_code == 400
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import explain
+import parser
+
+
+@pytest.mark.parametrize('condition, selectivity', [
+    ("a = 1", explain.EQUALITY_SELECTIVITY),
+    ("a > 1", explain.RANGE_SELECTIVITY),
+    ("a = 1 ∧ b ≤ 2", explain.EQUALITY_SELECTIVITY * explain.RANGE_SELECTIVITY),
+    ("a = 1 ∨ b = 2", 0.1 + 0.1 - 0.1 * 0.1),
+    # The operators inside the literals are not counted
+    ("a = 'x ∨ y'", explain.EQUALITY_SELECTIVITY),
+    ("a = \"x ∧ y > z\"", explain.EQUALITY_SELECTIVITY),
+    ("a = 'it\\'s ∨ <'", explain.EQUALITY_SELECTIVITY),
+])
+def test_selectivity(condition, selectivity):
+    assert explain.Statistics().selectivity(condition) == pytest.approx(selectivity)
+
+
+def test_annotate():
+    statistics = explain.Statistics({'Books': 200, 'Articles': 50}, default_cardinality=10)
+    tree = explain.annotate(parser.tree("π author (σ year > 2000 (Books)) ∪ π author (Articles ⋈ Authors)"),
+                            statistics)
+    selection = tree.left.child
+    assert selection.estimate.input_rows == 200
+    assert selection.estimate.rows == pytest.approx(200 * explain.RANGE_SELECTIVITY)
+    join = tree.right.child
+    assert join.estimate.rows == pytest.approx(10)  # 50 * 10 / 50
+    assert join.estimate.cost == pytest.approx(50 + 10 + 50 + 10 + 10)
+    assert tree.estimate.rows == pytest.approx(selection.estimate.rows + join.estimate.rows)
+
+
+def test_to_dict():
+    plan = explain.explain("ρ author➡writer (Books * Articles)", explain.Statistics({'Books': 3, 'Articles': 4}),
+                           'json')
+    assert plan == {
+        'operator': 'ρ', 'operation': 'rename', 'prop': 'author➡writer',
+        'input_rows': 12, 'rows': 12, 'cost': 19,
+        'children': [{
+            'operator': '*', 'operation': 'product', 'input_rows': 7, 'rows': 12, 'cost': 19,
+            'children': [
+                {'operator': 'Books', 'operation': 'relation', 'input_rows': 3, 'rows': 3, 'cost': 3, 'children': []},
+                {'operator': 'Articles', 'operation': 'relation', 'input_rows': 4, 'rows': 4, 'cost': 4,
+                 'children': []},
+            ],
+        }],
+    }
+
+
+def test_to_text():
+    text = explain.explain("σ a = 1 (Books)", explain.Statistics({'Books': 100}))
+    assert text == 'σ a = 1  (rows=10 input=100 cost=200)\n  Books  (rows=100 input=100 cost=100)\n'
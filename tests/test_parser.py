@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import parser
+import relation
+
+
+@pytest.mark.parametrize('expression, tokens', [
+    ("Books", ['Books']),
+    ("((((Books))))", [[[[['Books']]]]]),
+    ("πsubject, author (Books)", ['π', 'subject, author', ['Books']]),
+    ("σ a='x(y' (Books)", ['σ', "a='x(y'", ['Books']]),
+    ("σ a='it\\'s (' ∧ b=2 (Books)", ['σ', "a='it\\'s (' ∧ b=2", ['Books']]),
+    ("(A ∪ B) ⋈ (C - D)", [['A', '∪', 'B'], '⋈', ['C', '-', 'D']]),
+    ("π a B", ['π', 'a', 'B']),
+])
+def test_tokenize(expression, tokens):
+    assert parser.tokenize(expression) == tokens
+
+
+def test_tokenize_missing_parenthesis():
+    with pytest.raises(parser.TokenizerException):
+        parser.tokenize("σ a=1 (")
+
+
+@pytest.mark.parametrize('expression, python', [
+    ("π author (Books) ∪ π author (Articles)", "Books.projection('author').union(Articles.projection('author'))"),
+    ("πsubject, author (Books)", "Books.projection('subject','author')"),
+    ("ρ name➡n, age➡a (People)", "People.rename({'name':'n','age':'a'})"),
+    ("ρEmployeeName/Name(Employee)", "Employee.rename({'Name':'EmployeeName'})"),
+    ("ρStaff(Employee)", "Employee.rename({'Staff'})"),
+    ("σauthor = 'tutorialspoint'(Books * Articles)", 'Books.product(Articles).selection("author = \'tutorialspoint\'")'),
+    ("A ∪ B ∪ C - D", 'A.union(B).union(C).difference(D)'),
+    ("A ⧓ B ÷ C", 'A.outer(B).division(C)'),
+])
+def test_parse(expression, python):
+    assert parser.parse(expression) == python
+
+
+@pytest.mark.parametrize('expression', ["A ∪", "∪ B", "σ a=1", "A B", "1abc"])
+def test_parse_errors(expression):
+    with pytest.raises(parser.ParserException):
+        parser.parse(expression)
+
+
+# Attribute names are pasted in the generated code, they must not be able to inject any
+@pytest.mark.parametrize('expression', [
+    'π a\'"if[c\tfor\tc\tin\t().__class__.__base__.__subclasses__()\tif\tc.__name__=="_wrap_close"][0]'
+    '.__init__.__globals__["system"]("echo\tPWNED")else"a\'(Books)',
+    "ρ a➡b'}|{'c (Books)",
+    "π a, b') + ('c (Books)",
+    "ρ a➡b, Staff (Books)",
+])
+def test_parse_invalid_names(expression):
+    with pytest.raises(parser.ParserException):
+        parser.parse(expression)
+
+
+@pytest.mark.parametrize('expression', [
+    "π author (Books) ∪ π author (Articles)",
+    "ρ author➡writer (σ year > 2000 (Books))",
+    "ρStaff(Books) - Books",
+])
+def test_plan(expression):
+    context = {
+        'Books': relation.Relation(['author', 'year'], [('ann', 1999), ('bob', 2005)]),
+        'Articles': relation.Relation(['author'], [('cid',), ('ann',)]),
+    }
+    planned = parser.plan(expression)(context)
+    evaluated = parser.parse(expression)(context)
+    assert planned.header == evaluated.header
+    assert sorted(planned) == sorted(evaluated)
+
+
+def test_plan_unknown_relation():
+    with pytest.raises(NameError):
+        parser.plan("π author (Missing)")({})
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+import itertools
+
+import pytest
+
+import relation
+
+
+def logged(name, header, rows, log, size=None):
+    """Relation that appends its name to log for every row it produces"""
+    def generate():
+        for row in rows:
+            log.append(name)
+            yield row
+    return relation.Relation(header, generate, size)
+
+
+def test_stored_rows():
+    r = relation.Relation(['a', 'b'], [[1, 2], (1, 2), (3, 4)])
+    assert r.size == 2
+    assert list(r) == [(1, 2), (3, 4)]
+
+
+@pytest.mark.parametrize('header, rows', [(['a', 'a'], []), (['1a'], []), (['a'], [(1, 2)])])
+def test_invalid_relations(header, rows):
+    with pytest.raises(relation.RelationException):
+        relation.Relation(header, rows)
+
+
+def test_streaming():
+    # The rows are infinite, only the ones needed for the first chunk are computed
+    numbers = relation.Relation(['n'], lambda: ((i,) for i in itertools.count()))
+    result = numbers.selection('n > 5').projection('n')
+    assert next(result.chunks(3)) == [(6,), (7,), (8,)]
+
+
+def test_chunks():
+    r = relation.Relation(['n'], [(i,) for i in range(7)])
+    assert [len(chunk) for chunk in r.chunks(3)] == [3, 3, 1]
+    assert list(relation.Relation(['n']).chunks(3)) == []
+
+
+def test_selection():
+    r = relation.Relation(['a', 'b'], [(1, 'x'), (2, 'y'), (3, "it's")])
+    assert list(r.selection('a ≥ 2 ∧ b ≠ "y"')) == [(3, "it's")]
+    assert list(r.selection("b = 'it\\'s' ∨ a = 1")) == [(1, 'x'), (3, "it's")]
+    assert list(r.selection('¬ a = 1')) == [(2, 'y'), (3, "it's")]
+
+
+@pytest.mark.parametrize('condition', [
+    'c = 1',
+    'a =',
+    'a.__class__ = 1',
+    '(lambda: 1)() = 1',
+    '[c for c in ()] = 1',
+])
+def test_invalid_selection(condition):
+    r = relation.Relation(['a'], [(1,)])
+    with pytest.raises(relation.RelationException):
+        r.selection(condition)
+
+
+def test_projection_and_rename():
+    r = relation.Relation(['a', 'b'], [(1, 2), (1, 3)])
+    assert list(r.projection('a')) == [(1,)]
+    assert r.projection('a', 'b') is r
+    renamed = r.rename({'a': 'c'})
+    assert renamed.header == ('c', 'b')
+    assert list(renamed) == list(r)
+    assert r.rename({'Staff'}) is r
+    with pytest.raises(relation.RelationException):
+        r.projection('c')
+    with pytest.raises(relation.RelationException):
+        r.rename({'c': 'd'})
+
+
+def test_product():
+    log = []
+    left = logged('L', ['a'], [(1,), (2,), (3,)], log)
+    right = logged('R', ['b'], [('x',), ('y',)], log)
+    assert sorted(left.product(right)) == [(1, 'x'), (1, 'y'), (2, 'x'), (2, 'y'), (3, 'x'), (3, 'y')]
+    # Every relation is read only once
+    assert sorted(log) == ['L'] * 3 + ['R'] * 2
+    with pytest.raises(relation.RelationException):
+        left.product(left)
+
+
+@pytest.mark.parametrize('left_size, right_size, build', [(2, 3, 'L'), (3, 2, 'R'), (None, 2, 'R'), (2, None, 'R')])
+def test_hash_join_build_side(left_size, right_size, build):
+    log = []
+    left = logged('L', ['a', 'b'], [(1, 'x'), (2, 'y')], log, left_size)
+    right = logged('R', ['b', 'c'], [('x', 10), ('z', 30), ('x', 11)], log, right_size)
+    assert sorted(left.join(right)) == [(1, 'x', 10), (1, 'x', 11)]
+    # The build side is read completely before the other one
+    assert log[:log.count(build)] == [build] * log.count(build)
+
+
+@pytest.mark.parametrize('left_size, right_size', [(2, 3), (3, 2), (None, None)])
+def test_outer_joins(left_size, right_size):
+    left = relation.Relation(['a', 'b'], lambda: iter([(1, 'x'), (2, 'y')]), left_size)
+    right = relation.Relation(['b', 'c'], lambda: iter([('x', 10), ('z', 30)]), right_size)
+    assert left.outer_left(right).header == ('a', 'b', 'c')
+    assert sorted(left.outer_left(right), key=repr) == [(1, 'x', 10), (2, 'y', None)]
+    assert sorted(left.outer_right(right), key=repr) == [(1, 'x', 10), (None, 'z', 30)]
+    assert sorted(left.outer(right), key=repr) == [(1, 'x', 10), (2, 'y', None), (None, 'z', 30)]
+
+
+def test_set_operations():
+    left = relation.Relation(['a', 'b'], [(1, 2), (3, 4)])
+    right = relation.Relation(['b', 'a'], [(2, 1), (6, 5)])
+    assert sorted(left.union(right)) == [(1, 2), (3, 4), (5, 6)]
+    assert list(left.difference(right)) == [(3, 4)]
+    assert list(left.intersection(right)) == [(1, 2)]
+    with pytest.raises(relation.RelationException):
+        left.union(relation.Relation(['a'], [(1,)]))
+
+
+def test_division():
+    enrol = relation.Relation(['student', 'course'],
+                              [('s1', 'c1'), ('s1', 'c2'), ('s2', 'c1'), ('s3', 'c2'), ('s3', 'c1'), ('s3', 'c3')])
+    courses = relation.Relation(['course'], [('c1',), ('c2',)])
+    assert enrol.division(courses).header == ('student',)
+    assert sorted(enrol.division(courses)) == [('s1',), ('s3',)]
+    assert sorted(enrol.division(relation.Relation(['course']))) == [('s1',), ('s2',), ('s3',)]
+    with pytest.raises(relation.RelationException):
+        courses.division(enrol)
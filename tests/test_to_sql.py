@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+import parser
+import relation
+import to_sql
+
+
+@pytest.mark.parametrize('condition, sql', [
+    ("a = 1 ∧ b ≠ 2", "a = 1  AND  b <> 2"),
+    ("a == 'x' ∨ ¬ b ≥ 2", "a = 'x'  OR   NOT  b >= 2"),
+    ("a = 'it\\'s'", "a = 'it''s'"),
+    ("a = 'x\\' OR \\'1\\'=\\'1'", "a = 'x'' OR ''1''=''1'"),
+    ('a = "say \\"hi\\" it\'s"', "a = 'say \"hi\" it''s'"),
+])
+def test_condition(condition, sql):
+    assert to_sql._condition(condition) == sql
+
+
+# The queries of every dialect are run on SQLite and compared with the
+# result of the relations. MySQL only differs in <=>, which SQLite calls IS.
+DATA = {
+    'Books': (['author', 'title', 'year'], [('a', 't1', 1999), ('b', 't2', 2005), ('c', 't3', 2010), ('a', 't4', 2011)]),
+    'Articles': (['author', 'venue'], [('a', 'v1'), ('d', 'v2'), ('c', 'v1')]),
+    'Enrol': (['student', 'course'], [('s1', 'c1'), ('s1', 'c2'), ('s2', 'c1'), ('s3', 'c2'), ('s3', 'c1')]),
+    'Courses': (['course'], [('c1',), ('c2',)]),
+}
+
+
+@pytest.fixture(scope='module')
+def database():
+    db = sqlite3.connect(':memory:')
+    for name, (header, rows) in DATA.items():
+        db.execute('CREATE TABLE %s (%s)' % (name, ', '.join(header)))
+        db.executemany('INSERT INTO %s VALUES (%s)' % (name, ', '.join('?' * len(header))), rows)
+    yield db
+    db.close()
+
+
+@pytest.mark.parametrize('dialect', sorted(to_sql.dialects))
+@pytest.mark.parametrize('expression', [
+    "π author (Books) ∪ π author (Articles)",
+    "π author (Books) - π author (Articles)",
+    "π author (Books) ∩ π author (Articles)",
+    "π author (Books) - (π author (Articles) ∪ π author (σ year > 2008 (Books)))",
+    "(π author (Books) ∪ π author (Articles)) - π author (Articles)",
+    "π title (Books) - π title (σ year > 2006 (Books))",
+    "Books - Books",
+    "Enrol ÷ Courses",
+    "π title (σ year ≥ 2005 ∧ author = \"a\" (Books))",
+    "π title (σ author = 'a' ∨ year < 2000 (Books))",
+    "Books ⋈ Articles",
+    "Books ⧑ Articles",
+    "Books ⧒ Articles",
+    "Books ⧓ Articles",
+    "Books ⋈ Books",
+    "π course (Courses ⧓ Courses)",
+    "π writer (ρ author➡writer (π author (Articles)))",
+    "π author (ρ Staff (Articles))",
+    "Courses * ρ course➡other (Courses)",
+    "π author (Books * Courses)",
+])
+def test_generate(database, dialect, expression):
+    relations = {name: relation.Relation(header, rows) for name, (header, rows) in DATA.items()}
+    expected = parser.plan(expression)(relations)
+    schema = {name: header for name, (header, _) in DATA.items()}
+
+    sql = to_sql.generate(parser.tree(expression), dialect, schema)
+    if dialect == 'mysql':
+        sql = sql.replace('<=>', 'IS')
+    cursor = database.execute(sql)
+    assert [column[0] for column in cursor.description] == list(expected.header)
+    assert sorted(cursor.fetchall(), key=repr) == sorted(expected, key=repr)
+
+
+def test_generate_errors():
+    with pytest.raises(to_sql.SQLException):
+        to_sql.generate(parser.tree("Books - Articles"), 'mysql')
+    with pytest.raises(to_sql.SQLException):
+        to_sql.generate(parser.tree("Books * Books"), 'sqlite', {'Books': ['author']})
+    with pytest.raises(to_sql.SQLException):
+        to_sql.generate(parser.tree("Books"), 'oracle')
@@ -5,7 +5,11 @@
 # to convert expressions into python expressions and to get the parse-tree
 # of the expression.
 #
-from typing import Dict, Union
+import ast
+from typing import Dict, List, Optional, Union
+
+import parser
+import rtypes
 
 
 def to_mysql(python_callable_string: str) -> Union[Dict[str, str], str]:
@@ -43,7 +47,7 @@ def to_mysql(python_callable_string: str) -> Union[Dict[str, str], str]:
             selection_statement = "where {condition}".format(condition=condition)
         projection_portion = union_portion.split('projection')[1]
         without_opening_bracket = projection_portion.split('(')[1]
-        props = without_opening_bracket.split(')', 1)[0].replace('"', '')
+        props = without_opening_bracket.split(')', 1)[0].replace("'", '')
         query = 'select {props} from {table_two} {selection_statement}'.format(props=props, table_two=second_table,
                                                                                selection_statement=selection_statement if selection_statement else '')
         union_statement = query
@@ -63,7 +67,7 @@ def to_mysql(python_callable_string: str) -> Union[Dict[str, str], str]:
         second_table = removed_opening_bracket.split('.')[0]
         projection_portion = difference_portion.split('projection')[1]
         without_opening_bracket = projection_portion.split('(')[1]
-        props = without_opening_bracket.split(')', 1)[0].replace('"', '')
+        props = without_opening_bracket.split(')', 1)[0].replace("'", '')
         query = '{query} left join {table_two} using ({prop}) where {table_two}.{prop} is null'.format(
             query=query,
             table_two=second_table,
@@ -94,7 +98,7 @@ def to_mysql(python_callable_string: str) -> Union[Dict[str, str], str]:
     if 'projection' in python_callable_string:
         projection_portion = python_callable_string.split('projection')[1]
         operation_the_other_string = projection_portion.split('(')[1]
-        props = operation_the_other_string.split(')', 1)[0].replace('"', '')
+        props = operation_the_other_string.split(')', 1)[0].replace("'", '')
         query = 'select {}'.format(props)
 
     # Mysql does not have a product statement, but the same can be simulated using
@@ -158,13 +162,13 @@ def to_mysql(python_callable_string: str) -> Union[Dict[str, str], str]:
         first_table = python_callable_string.split('.')[0]
         projection_portion = python_callable_string.split('projection')[1]
         operation_the_other_string = projection_portion.split('(')[1]
-        props = operation_the_other_string.split(')', 1)[0].replace('"', '')
+        props = operation_the_other_string.split(')', 1)[0].replace("'", '')
         query = 'select distinct {props} from {table_one}'.format(props=props, table_one=first_table)
         removed_opening_bracket = intersection_portion.split('(')[1]
         second_table = removed_opening_bracket.split('.')[0]
         projection_portion = intersection_portion.split('projection')[1]
         without_opening_bracket = projection_portion.split('(')[1]
-        props = without_opening_bracket.split(')', 1)[0].replace('"', '')
+        props = without_opening_bracket.split(')', 1)[0].replace("'", '')
         query = "{query} inner join {table_two} using({prop})".format(
             query=query, table_two=second_table, prop=props)
 
@@ -174,23 +178,290 @@ def to_mysql(python_callable_string: str) -> Union[Dict[str, str], str]:
     # ?query=ρStaff(Employee)
     if 'rename' in python_callable_string:
         relation_name = python_callable_string.split('.')[0]
-        rename_operation = python_callable_string.split('rename')[1]
-        rename_props = rename_operation.split('({"')[1]
-        if '/' in rename_props:
-            new_attribute_name = rename_props.split('/')[0]
-            remove_ending_characters = rename_props.split('"})')[0]
-            old_attribute_name = remove_ending_characters.split('/')[1]
+        rename_operation = python_callable_string.split('rename(', 1)[1]
+        rename_props = ast.literal_eval(rename_operation.split('})', 1)[0] + '}')
+        if isinstance(rename_props, dict):
+            old_attribute_name, new_attribute_name = next(iter(rename_props.items()))
             return {
                 'relation_name': relation_name,
                 'new_attribute_name': new_attribute_name,
                 'old_attribute_name': old_attribute_name
             }
         else:
-            rename_props = rename_operation.split('({"')[1]
-            new_relation_name = rename_props.split('"})')[0]
             return {
-                'new_relation_name': new_relation_name,
+                'new_relation_name': next(iter(rename_props)),
                 'old_relation_name': relation_name
             }
     # And finally return the fully constructed mysql compatible sql statement
     return query
+
+
+
+# Dialects
+#
+# to_mysql translates the python string, and only understands the
+# shapes of queries listed in its comments. The code below works on the
+# parse tree instead: every node becomes a query, and the operators
+# that databases implement differently are delegated to a Dialect,
+# which writes the form that runs best on that database.
+
+class SQLException(Exception):
+    pass
+
+
+class Query:
+    """
+    The SQL of a node of the tree.
+
+    sql is a complete select statement and columns is the list of
+    attributes of the result, or None if they are not known.
+    table is the name of the relation, if the query reads a whole relation.
+    compound is true if sql is a UNION/EXCEPT/INTERSECT of two queries.
+    """
+
+    def __init__(self, sql: str, columns: Optional[List[str]], table: Optional[str] = None,
+                 compound: bool = False) -> None:
+        self.sql = sql
+        self.columns = columns
+        self.table = table
+        self.compound = compound
+
+
+class Dialect:
+    """
+    The SQL standard form of every operator, which is also the fastest
+    on PostgreSQL: native set operators, natural outer joins and the
+    division as a GROUP BY/HAVING count.
+    """
+    name = 'postgresql'
+
+    def __init__(self) -> None:
+        self._aliases = 0
+
+    def source(self, query: Query, alias: Optional[str] = None) -> str:
+        """
+        Returns what to write in a FROM clause to read the query.
+        Every call gives a new name to derived tables, so a query
+        can be read more than once in the same statement.
+        """
+        if query.table is not None:
+            return query.table if alias is None else '{} AS {}'.format(query.table, alias)
+        if alias is None:
+            self._aliases += 1
+            alias = 't%d' % self._aliases
+        return '({}) AS {}'.format(query.sql, alias)
+
+    def join_source(self, query: Query) -> str:
+        """
+        Like source, for the operands of joins and products: relations
+        are always given a new name, so that the same relation can be
+        on both sides.
+        """
+        if query.table is not None:
+            return self.source(query, self.alias())
+        return self.source(query)
+
+    def alias(self) -> str:
+        """Returns a new name for a correlation"""
+        self._aliases += 1
+        return 't%d' % self._aliases
+
+    def operand(self, query: Query) -> str:
+        """Returns the query as an operand of a set operation.
+        Compound queries are nested, so that they are evaluated first"""
+        if query.compound:
+            return 'SELECT * FROM {}'.format(self.source(query))
+        return query.sql
+
+    def set_operation(self, operator: str, left: Query, right: Query) -> Query:
+        """Writes left UNION/EXCEPT/INTERSECT right"""
+        sql = '{} {} {}'.format(self.operand(left), operator, self.operand(right))
+        return Query(sql, left.columns or right.columns, compound=True)
+
+    def union(self, left: Query, right: Query) -> Query:
+        return self.set_operation('UNION', left, right)
+
+    def difference(self, left: Query, right: Query) -> Query:
+        return self.set_operation('EXCEPT', left, right)
+
+    def intersection(self, left: Query, right: Query) -> Query:
+        return self.set_operation('INTERSECT', left, right)
+
+    def outer_join(self, kind: str, left: Query, right: Query) -> Query:
+        """Writes a natural LEFT, RIGHT or FULL outer join"""
+        sql = 'SELECT * FROM {} NATURAL {} JOIN {}'.format(self.join_source(left), kind, self.join_source(right))
+        return Query(sql, _join_columns(left, right))
+
+    def outer_left(self, left: Query, right: Query) -> Query:
+        return self.outer_join('LEFT', left, right)
+
+    def outer_right(self, left: Query, right: Query) -> Query:
+        return self.outer_join('RIGHT', left, right)
+
+    def outer(self, left: Query, right: Query) -> Query:
+        return self.outer_join('FULL', left, right)
+
+    def division(self, left: Query, right: Query) -> Query:
+        """
+        Writes left ÷ right as the groups of left that match as many
+        rows of right as right contains.
+        """
+        divisor = _require_columns(right, 'division')
+        quotient = [c for c in _require_columns(left, 'division') if c not in divisor]
+        if not quotient:
+            raise SQLException('The dividend must have attributes that are not in the divisor')
+        attributes = ', '.join(quotient)
+        sql = 'SELECT {attributes} FROM (SELECT DISTINCT * FROM {left}) AS {a} ' \
+              'NATURAL JOIN (SELECT DISTINCT * FROM {right}) AS {b} GROUP BY {attributes} ' \
+              'HAVING COUNT(*) = (SELECT COUNT(*) FROM (SELECT DISTINCT * FROM {divisor}) AS {c})'.format(
+                attributes=attributes, left=self.source(left), a=self.alias(), right=self.source(right),
+                b=self.alias(), divisor=self.source(right), c=self.alias())
+        return Query(sql, quotient)
+
+
+class PostgreSQL(Dialect):
+    pass
+
+
+class SQLite(Dialect):
+    """
+    SQLite has the same set operators as PostgreSQL.
+    RIGHT and FULL joins need SQLite 3.39 or newer.
+    """
+    name = 'sqlite'
+
+
+class MySQL(Dialect):
+    """
+    MySQL (before 8.0.31) has no EXCEPT, INTERSECT and FULL JOIN.
+    The difference is written as a NOT EXISTS anti-join and the
+    intersection as an EXISTS semi-join, which MySQL optimizes better
+    than a LEFT JOIN ... IS NULL or an INNER JOIN with DISTINCT.
+    """
+    name = 'mysql'
+
+    def correlated(self, exists: str, left: Query, right: Query, operation: str) -> Query:
+        """
+        Writes the rows of left for which a matching row of right does (not) exist.
+        Like EXCEPT and INTERSECT, the attributes are matched by position.
+        """
+        columns = _require_columns(left, operation)
+        right_columns = _require_columns(right, operation)
+        if len(columns) != len(right_columns):
+            raise SQLException('The operands of %s must have the same number of attributes' % operation)
+        outer, inner = self.alias(), self.alias()
+        condition = ' AND '.join('{o}.{l} <=> {i}.{r}'.format(o=outer, i=inner, l=l, r=r)
+                                 for l, r in zip(columns, right_columns))
+        sql = 'SELECT DISTINCT * FROM {} WHERE {} (SELECT 1 FROM {} WHERE {})'.format(
+            self.source(left, outer), exists, self.source(right, inner), condition)
+        return Query(sql, columns)
+
+    def difference(self, left: Query, right: Query) -> Query:
+        return self.correlated('NOT EXISTS', left, right, 'difference')
+
+    def intersection(self, left: Query, right: Query) -> Query:
+        return self.correlated('EXISTS', left, right, 'intersection')
+
+    def outer(self, left: Query, right: Query) -> Query:
+        """FULL JOIN is the union of the LEFT and the RIGHT join"""
+        columns = _require_columns(Query('', _join_columns(left, right)), 'full outer join')
+        sql = 'SELECT {c} FROM {l} NATURAL LEFT JOIN {r} UNION SELECT {c} FROM {l2} NATURAL RIGHT JOIN {r2}'.format(
+            c=', '.join(columns), l=self.join_source(left), r=self.join_source(right),
+            l2=self.join_source(left), r2=self.join_source(right))
+        return Query(sql, columns, compound=True)
+
+
+dialects = {d.name: d for d in (MySQL, PostgreSQL, SQLite)}
+
+
+def _require_columns(query: Query, operation: str) -> List[str]:
+    """Returns the attributes of the query, that the operation needs to know"""
+    if query.columns is None:
+        raise SQLException('The attributes of the operands of %s must be known, '
+                           'use a projection or give the schema' % operation)
+    return query.columns
+
+
+def _join_columns(left: Query, right: Query) -> Optional[List[str]]:
+    """Returns the attributes of a natural join"""
+    if left.columns is None or right.columns is None:
+        return None
+    return left.columns + [c for c in right.columns if c not in left.columns]
+
+
+def _attributes(prop: str) -> List[str]:
+    """Splits and validates a comma separated list of attributes"""
+    attributes = [a.strip() for a in prop.split(',')]
+    for a in attributes:
+        if not rtypes.is_valid_relation_name(a):
+            raise SQLException("'%s' is not a valid attribute name" % a)
+    return attributes
+
+
+_CONDITION_OPERATORS = {'==': '=', '!=': '<>', '≠': '<>', '≤': '<=', '≥': '>=',
+                        '∧': ' AND ', '∨': ' OR ', '¬': ' NOT '}
+
+
+def _condition(condition: str) -> str:
+    """Translates the condition of a selection to SQL"""
+    def token(match):
+        t = match.group(0)
+        # SQL strings use single quotes, escaped by doubling them
+        if t.startswith('"'):
+            return "'%s'" % t[1:-1].replace('\\"', '"').replace("'", "''")
+        elif t.startswith("'"):
+            return "'%s'" % t[1:-1].replace("\\'", "'").replace("'", "''")
+        return _CONDITION_OPERATORS.get(t, t)
+    return rtypes.CONDITION_TOKEN.sub(token, condition)
+
+
+def _translate(tree: parser.Node, dialect: Dialect, schema: Dict[str, List[str]]) -> Query:
+    """Returns the query for the subtree"""
+    if tree.kind == parser.RELATION:
+        name = str(tree.name)
+        return Query('SELECT * FROM {}'.format(name), schema.get(name), table=name)
+
+    if tree.kind == parser.UNARY:
+        child = _translate(tree.child, dialect, schema)
+        prop = str(tree.prop)
+        if tree.name == parser.SELECTION:
+            sql = 'SELECT * FROM {} WHERE {}'.format(dialect.source(child), _condition(prop))
+            return Query(sql, child.columns)
+        elif tree.name == parser.PROJECTION:
+            attributes = _attributes(prop)
+            sql = 'SELECT DISTINCT {} FROM {}'.format(', '.join(attributes), dialect.source(child))
+            return Query(sql, attributes)
+        elif parser.ARROW not in prop:  # Rename of the relation
+            sql = 'SELECT * FROM {}'.format(dialect.source(child, _attributes(prop)[0]))
+            return Query(sql, child.columns)
+        renames = {}
+        for item in prop.split(','):
+            old, new = item.split(parser.ARROW, 1)
+            renames[_attributes(old)[0]] = _attributes(new)[0]
+        columns = _require_columns(child, 'rename')
+        what = ', '.join('{} AS {}'.format(c, renames[c]) if c in renames else c for c in columns)
+        return Query('SELECT {} FROM {}'.format(what, dialect.source(child)), [renames.get(c, c) for c in columns])
+
+    left = _translate(tree.left, dialect, schema)
+    right = _translate(tree.right, dialect, schema)
+    if tree.name == parser.PRODUCT:
+        columns = None if left.columns is None or right.columns is None else left.columns + right.columns
+        if columns is not None and len(set(columns)) != len(columns):
+            raise SQLException('The operands of the product have common attributes')
+        sql = 'SELECT * FROM {} CROSS JOIN {}'.format(dialect.join_source(left), dialect.join_source(right))
+        return Query(sql, columns)
+    elif tree.name == parser.JOIN:
+        sql = 'SELECT * FROM {} NATURAL JOIN {}'.format(dialect.join_source(left), dialect.join_source(right))
+        return Query(sql, _join_columns(left, right))
+    return getattr(dialect, parser.op_functions[tree.name])(left, right)
+
+
+def generate(tree: parser.Node, dialect: str = 'mysql', schema: Optional[Dict[str, List[str]]] = None) -> str:
+    """
+    Converts the parse tree to a query for the given dialect.
+    schema associates relation names with their attributes, it is only
+    needed by the operators that must name the attributes.
+    """
+    if dialect not in dialects:
+        raise SQLException("Unknown SQL dialect '%s'" % dialect)
+    return _translate(tree, dialects[dialect](), schema or {}).sql